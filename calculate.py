@@ -1,52 +1,230 @@
 import argparse
+import functools
+import multiprocessing as mp
 from datetime import datetime, timedelta
 
+import numpy as np
 import pandas as pd
 import yaml
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional; fall back to plain Python loops
 
+    def njit(*args, **kwargs):
+        def decorator(func):
+            return func
+
+        return decorator
+
+
+@functools.lru_cache(maxsize=None)
 def parse_time_str(time_str):
     """Convert a HH:MM string to a timedelta object."""
     hours, minutes = map(int, time_str.split(":"))
     return timedelta(hours=hours, minutes=minutes)
 
 
-def calculate_band_cost(row, interval_times, bands, is_weekend):
+def precompute_bands(applicable_bands):
     """
-    Calculate the daily cost for a row (day) based on band rates.
+    Convert a list of bands into parallel arrays of integer minutes and rates.
 
     Parameters:
-    - row: a DataFrame row representing a single day's intervals
-    - interval_times: list of timedelta objects for each half-hour column
-    - bands: dict with 'weekday' and 'weekend' lists of band dicts {start, end, rate}
-    - is_weekend: boolean indicating if the day is weekend
+    - applicable_bands: list of band dicts {start, end, rate}
 
     Returns:
-    - daily cost (float)
+    - (start_minutes, end_minutes, rates) as np.int16, np.int16, np.float32 arrays
     """
-    total_cost = 0.0
-    applicable_bands = bands["weekend"] if is_weekend else bands["weekday"]
-
-    # Convert band times to timedeltas
-    band_ranges = []
+    starts, ends, rates = [], [], []
     for band in applicable_bands:
-        start_td = parse_time_str(band["start"])
-        end_td = parse_time_str(band["end"])
-        rate = band["rate"]
-        band_ranges.append((start_td, end_td, rate))
-
-    # Multiply each interval kWh by its band rate
-    for i, col in enumerate(interval_times):
-        kwh = row.iloc[i]
-        interval_time = interval_times[i]
-        for start, end, rate in band_ranges:
-            # Handle the special case where end="24:00"
-            if end.total_seconds() == 0:
-                end = timedelta(hours=24)
-            if start <= interval_time < end:
-                total_cost += kwh * rate
-                break  # Only one band applies
-    return total_cost
+        start_min = int(parse_time_str(band["start"]).total_seconds()) // 60
+        end_min = int(parse_time_str(band["end"]).total_seconds()) // 60
+        # Handle the special case where end="24:00"
+        if end_min == 0:
+            end_min = 1440
+        starts.append(start_min)
+        ends.append(end_min)
+        rates.append(band["rate"])
+    return (
+        np.array(starts, dtype=np.int16),
+        np.array(ends, dtype=np.int16),
+        np.array(rates, dtype=np.float32),
+    )
+
+
+def build_rate_vector(applicable_bands, n_intervals=48):
+    """
+    Build a per-interval rate vector from a list of bands.
+
+    Parameters:
+    - applicable_bands: list of band dicts {start, end, rate}
+    - n_intervals: number of half-hour intervals in a day
+
+    Returns:
+    - np.ndarray of rates, one per interval (0.0 where no band applies)
+    """
+    starts, ends, band_rates = precompute_bands(applicable_bands)
+
+    # Assign bands in reverse list order so that, where bands overlap, the
+    # first matching band in the list wins
+    interval_min = 30 * np.arange(n_intervals)
+    rates = np.zeros(n_intervals, dtype=np.float32)
+    for start, end, rate in zip(starts[::-1], ends[::-1], band_rates[::-1]):
+        rates[(interval_min >= start) & (interval_min < end)] = rate
+    return rates
+
+
+def bands_overlap(starts, ends):
+    """Return True if any two bands (as minute arrays) cover the same time."""
+    order = np.argsort(starts, kind="stable")
+    return bool(np.any(starts[order][1:] < ends[order][:-1]))
+
+
+@njit(cache=True)
+def band_cost_kernel(
+    mat, starts, ends, rates, weekend_mask, starts_we, ends_we, rates_we
+):
+    """
+    Calculate daily costs by scanning bands for every interval.
+
+    Used for plans with overlapping bands, where the first matching band
+    applies.
+
+    Parameters:
+    - mat: (days x intervals) kWh matrix
+    - starts, ends, rates: weekday band arrays from precompute_bands
+    - weekend_mask: boolean array, True for Saturday/Sunday
+    - starts_we, ends_we, rates_we: weekend band arrays from precompute_bands
+
+    Returns:
+    - np.ndarray of daily costs
+    """
+    n_days, n_intervals = mat.shape
+    daily_costs = np.zeros(n_days, dtype=np.float64)
+    for day in range(n_days):
+        if weekend_mask[day]:
+            day_starts, day_ends, day_rates = starts_we, ends_we, rates_we
+        else:
+            day_starts, day_ends, day_rates = starts, ends, rates
+        total_cost = 0.0
+        for i in range(n_intervals):
+            interval_min = 30 * i
+            for b in range(len(day_starts)):
+                if day_starts[b] <= interval_min < day_ends[b]:
+                    # float() keeps plain-Python and Numba sums in float64
+                    total_cost += float(mat[day, i] * day_rates[b])
+                    break  # Only one band applies
+        daily_costs[day] = total_cost
+    return daily_costs
+
+
+def process_plan(plan, mat, months, weekend_mask, daily_kwh):
+    """
+    Calculate the monthly summary for a single rate plan.
+
+    Parameters:
+    - plan: rate plan dict from the YAML file
+    - mat: (days x intervals) kWh matrix
+    - months: array of monthly periods, one per day
+    - weekend_mask: boolean array, True for Saturday/Sunday
+    - daily_kwh: array of total kWh per day
+
+    Returns:
+    - monthly summary DataFrame, ending with a TOTAL row
+    """
+    title = plan.get("title", "Unknown")
+    daily_rate = plan.get("daily_rate", 0.0)
+    per_kwh_rate = plan.get("per_kwh_rate", None)
+    bands = plan.get("bands", None)  # None for flat rate
+    fixed_discount = plan.get("fixed_discount", 0.0)  # percentage, e.g. 5 = 5%
+
+    # --- Calculate daily costs ---
+    if bands:
+        # Banded rate
+        wk_bands = precompute_bands(bands["weekday"])
+        we_bands = precompute_bands(bands["weekend"])
+        if bands_overlap(*wk_bands[:2]) or bands_overlap(*we_bands[:2]):
+            daily_costs = band_cost_kernel(mat, *wk_bands, weekend_mask, *we_bands)
+        else:
+            wk = build_rate_vector(bands["weekday"], mat.shape[1])
+            we = build_rate_vector(bands["weekend"], mat.shape[1])
+            daily_costs = np.where(weekend_mask, mat @ we, mat @ wk).astype(np.float64)
+    else:
+        # Flat rate
+        rate = per_kwh_rate if per_kwh_rate is not None else 0.0
+        daily_costs = daily_kwh * rate
+    daily_costs += daily_rate  # add daily fixed rate if specified
+
+    daily_df = pd.DataFrame(
+        {"month": months, "daily_kwh": daily_kwh, "daily_cost": daily_costs}
+    )
+
+    # --- Aggregate monthly ---
+    monthly = (
+        daily_df.groupby("month")
+        .agg(
+            Monthly_kWh=("daily_kwh", "sum"),
+            Days_in_month=("month", "size"),
+            Daily_cost=("daily_cost", "sum"),
+        )
+        .reset_index()
+    )
+    monthly["Fixed_cost"] = monthly["Days_in_month"] * daily_rate
+    monthly["Variable_cost"] = monthly["Daily_cost"] - monthly["Fixed_cost"]
+    monthly["Total_cost"] = monthly["Fixed_cost"] + monthly["Variable_cost"]
+
+    # Apply discount if present
+    if fixed_discount and fixed_discount > 0:
+        monthly["Discount"] = monthly["Total_cost"] * (fixed_discount / 100.0)
+        monthly["Total_cost"] = monthly["Total_cost"] - monthly["Discount"]
+    else:
+        monthly["Discount"] = 0.0
+
+    monthly["Title"] = title
+    monthly["Month"] = monthly["month"].dt.strftime("%Y-%m")
+    monthly = monthly[
+        [
+            "Title",
+            "Month",
+            "Monthly_kWh",
+            "Days_in_month",
+            "Fixed_cost",
+            "Variable_cost",
+            "Discount",
+            "Total_cost",
+        ]
+    ]
+
+    # --- Add total summary row ---
+    total_row = pd.DataFrame(
+        {
+            "Title": [title],
+            "Month": ["TOTAL"],
+            "Monthly_kWh": [monthly["Monthly_kWh"].sum().round(2)],
+            "Days_in_month": [monthly["Days_in_month"].sum()],
+            "Fixed_cost": [monthly["Fixed_cost"].sum().round(2)],
+            "Variable_cost": [monthly["Variable_cost"].sum().round(2)],
+            "Discount": [monthly["Discount"].sum().round(2)],
+            "Total_cost": [monthly["Total_cost"].sum().round(2)],
+        }
+    )
+    return pd.concat([monthly, total_row], ignore_index=True)
+
+
+# Per-worker copies of the plan-independent arrays, set by init_worker
+_shared_arrays = {}
+
+
+def init_worker(mat, months, weekend_mask, daily_kwh):
+    """Pool initializer: store the shared arrays in this worker process."""
+    _shared_arrays.update(
+        mat=mat, months=months, weekend_mask=weekend_mask, daily_kwh=daily_kwh
+    )
+
+
+def process_shared_plan(plan):
+    """Run process_plan for one plan against this worker's shared arrays."""
+    return process_plan(plan, **_shared_arrays)
 
 
 def main():
@@ -93,7 +271,15 @@ def main():
     if date_col not in df.columns:
         raise ValueError(f"Date column '{date_col}' not found in CSV file.")
 
-    df[date_col] = pd.to_datetime(df[date_col], errors="coerce")
+    # An explicit format skips per-value format inference
+    df[date_col] = pd.to_datetime(
+        df[date_col], format=config.get("date_format"), errors="coerce"
+    )
+    if len(df) and df[date_col].isna().all():
+        raise ValueError(
+            f"No values in date column '{date_col}' could be parsed as dates; "
+            "check date_format in the config file."
+        )
 
     # Ensure interval columns exist
     missing_cols = [col for col in interval_cols if col not in df.columns]
@@ -102,104 +288,43 @@ def main():
 
     df[interval_cols] = df[interval_cols].apply(pd.to_numeric, errors="coerce")
 
-    # Each interval represents a 30-minute period
-    interval_times = [timedelta(minutes=30 * i) for i in range(len(interval_cols))]
+    # Plan-independent per-day values
+    df["daily_kwh"] = df[interval_cols].sum(axis=1)
+
+    # (days x intervals) kWh matrix, shared by every plan; float32 halves the
+    # memory traffic of the per-plan matrix products
+    mat = df[interval_cols].to_numpy(dtype=np.float32)
+    df["is_weekend"] = df[date_col].dt.weekday >= 5  # Saturday=5, Sunday=6
+    weekend_mask = df["is_weekend"].to_numpy()
+
+    df["month"] = df[date_col].dt.to_period("M")
+    months = df["month"].array
+    daily_kwh = df["daily_kwh"].to_numpy()
 
     # --- Load YAML rate plans ---
     with open(args.yamlfile) as f:
         rate_plans = yaml.safe_load(f)
 
-    all_results = []
-
-    # --- Loop over each provider ---
-    for plan in rate_plans:
-        title = plan.get("title", "Unknown")
-        daily_rate = plan.get("daily_rate", 0.0)
-        per_kwh_rate = plan.get("per_kwh_rate", None)
-        bands = plan.get("bands", None)  # None for flat rate
-        fixed_discount = plan.get("fixed_discount", 0.0)  # percentage, e.g. 5 = 5%
-
-        daily_costs = []
-
-        # --- Calculate daily costs ---
-        for idx, row in df.iterrows():
-            day = row[date_col]
-            is_weekend = day.weekday() >= 5  # Saturday=5, Sunday=6
-            if bands:
-                # Banded rate
-                daily_cost = calculate_band_cost(
-                    row[interval_cols], interval_times, bands, is_weekend
-                )
-                daily_cost += daily_rate  # add daily fixed rate if specified
-            else:
-                # Flat rate
-                kwh = row[interval_cols].sum()
-                rate = per_kwh_rate if per_kwh_rate is not None else 0.0
-                daily_cost = daily_rate + kwh * rate
-            daily_costs.append(daily_cost)
-
-        df["daily_kwh"] = df[interval_cols].sum(axis=1)
-        df["daily_cost"] = daily_costs
-
-        # --- Aggregate monthly ---
-        monthly = (
-            df.groupby(df[date_col].dt.to_period("M"))
-            .agg(
-                Monthly_kWh=("daily_kwh", "sum"),
-                Days_in_month=(date_col, "count"),
-                Fixed_cost=("daily_cost", lambda x: (daily_rate * len(x))),
-                Variable_cost=("daily_cost", lambda x: x.sum() - (daily_rate * len(x))),
-            )
-            .reset_index()
-        )
-        monthly["Total_cost"] = monthly["Fixed_cost"] + monthly["Variable_cost"]
-
-        # Apply discount if present
-        if fixed_discount and fixed_discount > 0:
-            monthly["Discount"] = monthly["Total_cost"] * (fixed_discount / 100.0)
-            monthly["Total_cost"] = monthly["Total_cost"] - monthly["Discount"]
-        else:
-            monthly["Discount"] = 0.0
-
-        monthly["Title"] = title
-        monthly["Month"] = monthly[date_col].dt.strftime("%Y-%m")
-        monthly = monthly[
-            [
-                "Title",
-                "Month",
-                "Monthly_kWh",
-                "Days_in_month",
-                "Fixed_cost",
-                "Variable_cost",
-                "Discount",
-                "Total_cost",
-            ]
-        ]
-
-        # --- Add total summary row ---
-        total_row = pd.DataFrame(
-            {
-                "Title": [title],
-                "Month": ["TOTAL"],
-                "Monthly_kWh": [monthly["Monthly_kWh"].sum().round(2)],
-                "Days_in_month": [monthly["Days_in_month"].sum()],
-                "Fixed_cost": [monthly["Fixed_cost"].sum().round(2)],
-                "Variable_cost": [monthly["Variable_cost"].sum().round(2)],
-                "Discount": [monthly["Discount"].sum().round(2)],
-                "Total_cost": [monthly["Total_cost"].sum().round(2)],
-            }
-        )
-        monthly = pd.concat([monthly, total_row], ignore_index=True)
-
-        # Print total to terminal
-        print(f"\n=== Total summary for {title} ===")
-        print(total_row.to_string(index=False))
-
-        all_results.append(monthly)
+    if not rate_plans:
+        print(f"No rate plans found in {args.yamlfile}")
+        return
+
+    # --- Stream each plan's summary to the output CSV as it completes ---
+    # Shared arrays are sent to each worker once, not with every plan
+    with mp.Pool(
+        min(mp.cpu_count(), len(rate_plans)),
+        initializer=init_worker,
+        initargs=(mat, months, weekend_mask, daily_kwh),
+    ) as pool:
+        with open(args.out_file, "w", newline="") as out:
+            for i, monthly in enumerate(pool.imap(process_shared_plan, rate_plans)):
+                # Print total to terminal
+                total_row = monthly.tail(1)
+                print(f"\n=== Total summary for {total_row['Title'].iloc[0]} ===")
+                print(total_row.to_string(index=False))
+
+                monthly.to_csv(out, header=(i == 0), index=False)
 
-    # --- Save all results ---
-    final_df = pd.concat(all_results, ignore_index=True)
-    final_df.to_csv(args.out_file, index=False)
     print(f"\nSaved multi-plan monthly summary to {args.out_file}")
 
 
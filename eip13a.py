@@ -1,26 +1,48 @@
 import argparse
+import functools
 from datetime import datetime, timedelta
 
+import numpy as np
 import pandas as pd
 import yaml
 
 
+@functools.lru_cache(maxsize=None)
 def parse_time_str(time_str):
     """Convert HH:MM string to timedelta."""
     hours, minutes = map(int, time_str.split(":"))
     return timedelta(hours=hours, minutes=minutes)
 
 
-def calculate_band_cost(kwh, interval_time, bands):
-    """Return cost for one interval based on bands."""
+def precompute_bands(bands):
+    """Return (start_minutes, end_minutes, rates) arrays for a list of bands."""
+    starts, ends, rates = [], [], []
     for band in bands:
-        start_td = parse_time_str(band["start"])
-        end_td = parse_time_str(band["end"])
-        if end_td.total_seconds() == 0:  # handle "24:00"
-            end_td = timedelta(hours=24)
-        if start_td <= interval_time < end_td:
-            return kwh * band["rate"]
-    return 0.0
+        start_min = int(parse_time_str(band["start"]).total_seconds()) // 60
+        end_min = int(parse_time_str(band["end"]).total_seconds()) // 60
+        if end_min == 0:  # handle "24:00"
+            end_min = 1440
+        starts.append(start_min)
+        ends.append(end_min)
+        rates.append(band["rate"])
+    return (
+        np.array(starts, dtype=np.int16),
+        np.array(ends, dtype=np.int16),
+        np.array(rates, dtype=np.float64),
+    )
+
+
+def build_rate_vector(bands, n_slots=48):
+    """Return an array of rates, one per half-hour slot of the day."""
+    starts, ends, band_rates = precompute_bands(bands)
+
+    # Assign bands in reverse list order so that, where bands overlap, the
+    # first matching band in the list wins
+    interval_min = 30 * np.arange(n_slots)
+    rates = np.zeros(n_slots, dtype=np.float64)
+    for start, end, rate in zip(starts[::-1], ends[::-1], band_rates[::-1]):
+        rates[(interval_min >= start) & (interval_min < end)] = rate
+    return rates
 
 
 import csv
@@ -28,24 +50,57 @@ from datetime import datetime
 
 import pandas as pd
 
+# Integer codes for energy_flow_direction
+FLOW_CODES = {"I": 0, "X": 1}
 
-def load_eiep13a(csvfile):
+
+def load_eiep13a(csvfile, date_format=None):
     """
     Parse an EIEP13A CSV (lowercase header style) into a dataframe of half-hourly imports/exports.
+
+    date_format is an optional strftime format for read_start (None: inferred).
     """
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(csvfile)
+    # Read only the columns we use. Header/trailer rows share these columns, so
+    # dates and kWh are converted after filtering; string ops on the
+    # categoricals below only run once per distinct value.
+    df = pd.read_csv(
+        csvfile,
+        usecols=["rec_type", "read_start", "energy_flow_direction", "kwh"],
+        dtype={
+            "rec_type": "category",
+            "read_start": "str",
+            "energy_flow_direction": "category",
+            "kwh": "str",
+        },
+    )
     # Filter rows where "Record Type" is "DET"
-    df = df[df["rec_type"].str.strip().str.upper() == "DET"]
+    df = df[df["rec_type"].str.strip().str.upper() == "DET"].copy()
 
     # Convert columns to appropriate types
-    df["read_start"] = pd.to_datetime(df["read_start"].str.strip(), errors="coerce")
-    df["read_end"] = pd.to_datetime(df["read_end"].str.strip(), errors="coerce")
-    df["kwh"] = pd.to_numeric(df["kwh"], errors="coerce").fillna(0.0)
-    df["energy_flow_direction"] = df["energy_flow_direction"].str.strip().str.upper()
+    # Half-hour reads only need second resolution; cache reuses the parsed
+    # value for timestamp strings repeated across import/export rows
+    df["read_start"] = pd.to_datetime(
+        df["read_start"].str.strip(), format=date_format, errors="coerce", cache=True
+    ).astype("datetime64[s]")
+    if len(df) and df["read_start"].isna().all():
+        if date_format:
+            hint = f"matched --date-format {date_format!r}; check the format"
+        else:
+            hint = "could be parsed with an inferred format; pass --date-format"
+        raise ValueError(f"No read_start values in {csvfile} {hint}.")
+    df["kwh"] = pd.to_numeric(df["kwh"], errors="coerce").fillna(0.0).astype(np.float32)
+    # Encode flow direction as int8 (-1 for anything other than import/export)
+    df["flow"] = (
+        df["energy_flow_direction"]
+        .str.strip()
+        .str.upper()
+        .map(FLOW_CODES)
+        .fillna(-1)
+        .astype("int8")
+    )
 
     # Return the cleaned DataFrame
-    return df[["read_start", "read_end", "energy_flow_direction", "kwh"]]
+    return df[["read_start", "flow", "kwh"]]
 
 
 def main():
@@ -55,6 +110,11 @@ def main():
     parser.add_argument("csvfiles", nargs="+", help="EIEP13A CSV files")
     parser.add_argument("--yamlfile", default="rates.yaml", help="Rate plans file")
     parser.add_argument("--out-file", default="monthly_summary.csv", help="Output CSV")
+    parser.add_argument(
+        "--date-format",
+        default=None,
+        help='read_start format, e.g. "%%d/%%m/%%Y %%H:%%M:%%S" (default: inferred)',
+    )
     args = parser.parse_args()
 
     # --- Load rate plans ---
@@ -62,148 +122,170 @@ def main():
         rate_plans = yaml.safe_load(f)
 
     # --- Load all EIEP13A data ---
-    df_all = pd.concat([load_eiep13a(f) for f in args.csvfiles], ignore_index=True)
+    df_all = pd.concat(
+        [load_eiep13a(f, args.date_format) for f in args.csvfiles], ignore_index=True
+    )
 
+    df_all = df_all.dropna(subset=["read_start"])
     df_all["date"] = df_all["read_start"].dt.date
     df_all["month"] = df_all["read_start"].dt.to_period("M")
-    df_all["interval_time"] = (
+    df_all["interval_min"] = (
         df_all["read_start"].dt.hour * 60 + df_all["read_start"].dt.minute
-    )
-    df_all["interval_td"] = df_all["interval_time"].apply(
-        lambda m: timedelta(minutes=m)
-    )
-
-    all_results = []
-
-    for plan in rate_plans:
-        title = plan.get("title", "Unknown")
-        daily_rate = plan.get("daily_rate", 0.0)
-        per_kwh_rate = plan.get("per_kwh_rate")
-        bands = plan.get("bands")
-        fixed_discount = plan.get("fixed_discount", 0.0)
-        export_rates = plan.get("export_rates", None)  # new: support export rates
-
-        daily_results = []
-
-        for date, group in df_all.groupby("date"):
-            is_weekend = pd.to_datetime(date).weekday() >= 5
-            imports, exports = 0.0, 0.0
-
-            for _, row in group.iterrows():
-                kwh = row["kwh"]
-                interval_td = row["interval_td"]
-
-                if row["energy_flow_direction"] == "I":  # Import
-                    if bands:
-                        applicable = (
-                            bands["weekend"] if is_weekend else bands["weekday"]
-                        )
-                        imports += calculate_band_cost(kwh, interval_td, applicable)
+    ).astype(np.int16)
+    # Half-hour slot index; band tables are indexed by slot start minute
+    df_all["slot"] = (df_all["interval_min"] // 30).astype(np.int8)
+    # Saturday=5, Sunday=6; computed once rather than per day per plan
+    df_all["is_weekend"] = (df_all["read_start"].dt.weekday >= 5).astype(np.bool_)
+
+    # Index into a (weekday + weekend) rate table: weekend slots are offset by 48
+    day_slot = df_all["slot"].to_numpy().astype(np.int16)
+    day_slot += 48 * df_all["is_weekend"].to_numpy()
+    # kwh is stored as float32; cost arithmetic is done in float64
+    kwh = df_all["kwh"].to_numpy(dtype=np.float64)
+    flow = df_all["flow"].to_numpy()
+    not_import = flow != FLOW_CODES["I"]
+    not_export = flow != FLOW_CODES["X"]
+
+    # Per-interval rate/cost buffers, reused for every plan
+    import_buf = np.empty(len(df_all), dtype=np.float64)
+    export_buf = np.empty(len(df_all), dtype=np.float64)
+
+    with open(args.out_file, "w", newline="") as out:
+        for i, plan in enumerate(rate_plans):
+            title = plan.get("title", "Unknown")
+            daily_rate = plan.get("daily_rate", 0.0)
+            per_kwh_rate = plan.get("per_kwh_rate")
+            bands = plan.get("bands")
+            fixed_discount = plan.get("fixed_discount", 0.0)
+            export_rates = plan.get("export_rates", None)  # new: support export rates
+
+            # --- Per-interval import rates ---
+            if bands:
+                import_table = np.concatenate(
+                    [
+                        build_rate_vector(bands["weekday"]),
+                        build_rate_vector(bands["weekend"]),
+                    ]
+                )
+                np.take(import_table, day_slot, out=import_buf)
+            else:
+                import_buf.fill(per_kwh_rate if per_kwh_rate is not None else 0.0)
+
+            # --- Per-interval export rates (exports ignored without export_rates) ---
+            export_buf.fill(0.0)
+            if export_rates:
+                export_vectors = []
+                for day_type in ("weekday", "weekend"):
+                    applicable = export_rates.get(day_type)
+                    if applicable:
+                        export_vectors.append(build_rate_vector(applicable))
                     else:
-                        rate = per_kwh_rate if per_kwh_rate is not None else 0.0
-                        imports += kwh * rate
-                elif row["energy_flow_direction"] == "X":  # Export
-                    if export_rates:
-                        applicable = export_rates.get(
-                            "weekend" if is_weekend else "weekday"
+                        export_vectors.append(
+                            np.full(48, export_rates.get("flat", 0.0))
                         )
-                        if applicable:
-                            exports += calculate_band_cost(kwh, interval_td, applicable)
-                        else:
-                            rate = export_rates.get("flat", 0.0)
-                            exports += kwh * rate
-                    # else: exports ignored
-
-            daily_cost = daily_rate + imports - exports
-            daily_results.append((date, daily_cost, imports, exports))
-
-        daily_df = pd.DataFrame(
-            daily_results, columns=["date", "daily_cost", "imports", "exports"]
-        )
-        monthly = (
-            daily_df.groupby(
-                daily_df["date"].map(lambda d: pd.to_datetime(d).to_period("M"))
+                export_table = np.concatenate(export_vectors)
+                np.take(export_table, day_slot, out=export_buf)
+
+            # --- Per-interval costs, computed in place over the rate buffers ---
+            np.multiply(kwh, import_buf, out=import_buf)
+            np.copyto(import_buf, 0.0, where=not_import)
+            np.multiply(kwh, export_buf, out=export_buf)
+            np.copyto(export_buf, 0.0, where=not_export)
+            df_all["import_cost"] = import_buf
+            df_all["export_cost"] = export_buf
+
+            daily_df = (
+                df_all.groupby("date", sort=False)
+                .agg(
+                    month=("month", "first"),
+                    imports=("import_cost", "sum"),
+                    exports=("export_cost", "sum"),
+                )
+                .reset_index()
+            )
+            daily_df["daily_cost"] = (
+                daily_rate + daily_df["imports"] - daily_df["exports"]
             )
-            .agg(
-                Fixed_cost=("daily_cost", lambda x: daily_rate * len(x)),
-                Variable_cost=("imports", "sum"),
-                Credits=("exports", "sum"),
-                Days_in_month=("date", "count"),
+            monthly = (
+                daily_df.groupby("month")
+                .agg(
+                    Days_in_month=("date", "size"),
+                    Variable_cost=("imports", "sum"),
+                    Credits=("exports", "sum"),
+                )
+                .reset_index()
             )
-            .reset_index()
-        )
-        totalcost = monthly["Fixed_cost"] + monthly["Variable_cost"]
-
-        monthly["Total_cost"] = (
-            monthly["Fixed_cost"] + monthly["Variable_cost"] - monthly["Credits"]
-        )
-        # Pre load column with 0
-        monthly["Discounts"] = 0.0
-        if fixed_discount:
-            monthly["Discounts"] = monthly["Total_cost"] * (fixed_discount / 100)
-            monthly["Total_cost"] *= 1 - fixed_discount / 100
-
-        monthly["Title"] = title
-        monthly["Month"] = monthly["date"].dt.strftime("%Y-%m")
-        monthly["totalcostnotadjusted"] = totalcost
-        monthly = monthly[
-            [
-                "Title",
-                "Month",
-                "Days_in_month",
-                "Fixed_cost",
-                "Variable_cost",
-                "Credits",
-                "Discounts",
-                "Total_cost",
-                "totalcostnotadjusted",
+            monthly["Fixed_cost"] = monthly["Days_in_month"] * daily_rate
+            totalcost = monthly["Fixed_cost"] + monthly["Variable_cost"]
+
+            monthly["Total_cost"] = (
+                monthly["Fixed_cost"] + monthly["Variable_cost"] - monthly["Credits"]
+            )
+            # Pre load column with 0
+            monthly["Discounts"] = 0.0
+            if fixed_discount:
+                monthly["Discounts"] = monthly["Total_cost"] * (fixed_discount / 100)
+                monthly["Total_cost"] *= 1 - fixed_discount / 100
+
+            monthly["Title"] = title
+            monthly["Month"] = monthly["month"].dt.strftime("%Y-%m")
+            monthly["totalcostnotadjusted"] = totalcost
+            monthly = monthly[
+                [
+                    "Title",
+                    "Month",
+                    "Days_in_month",
+                    "Fixed_cost",
+                    "Variable_cost",
+                    "Credits",
+                    "Discounts",
+                    "Total_cost",
+                    "totalcostnotadjusted",
+                ]
             ]
-        ]
-        # --- Add total summary row ---
-        total_row = pd.DataFrame(
-            {
-                "Title": [title],
-                "Month": ["TOTAL"],
-                "Days_in_month": [monthly["Days_in_month"].sum()],
-                "Fixed_cost": [monthly["Fixed_cost"].sum().round(2)],
-                "Variable_cost": [monthly["Variable_cost"].sum().round(2)],
-                "Credits": [monthly["Credits"].sum().round(2)],
-                "Discounts": [monthly["Discounts"].sum().round(2)],
-                "Total_cost": [monthly["Total_cost"].sum().round(2)],
-                "totalcostnotadjusted": [
-                    monthly["totalcostnotadjusted"].sum().round(2)
-                ],
-            }
-        )
-        monthly = pd.concat([monthly, total_row], ignore_index=True)
-
-        # --- Print summary to console ---
-        total_days = total_row["Days_in_month"].iloc[0]
-        fixed_cost = total_row["Fixed_cost"].iloc[0]
-        variable_cost = total_row["Variable_cost"].iloc[0]
-        credits = total_row["Credits"].iloc[0]
-        discounts = total_row["Discounts"].iloc[0]
-        total_cost = total_row["Total_cost"].iloc[0]
-        total_cost_notadjusted = total_row["totalcostnotadjusted"].iloc[0]
-
-        print(f"\n=== Summary for plan: {title} ===")
-        print(f"  Total days: {total_days}")
-        print(f"  Fixed cost: ${fixed_cost:.2f}")
-        print(f"  Variable cost: ${variable_cost:.2f}")
-        print(f"  Credits from exports: ${credits:.2f}")
-        print(f"  Discounts saved: ${discounts:.2f}")
-        print(f"  TOTAL cost: ${total_cost:.2f}")
-        print(
-            f"  Total before discounts and export credits: ${total_cost_notadjusted:.2f}"
-        )
-        print("=" * 40)
-
-        all_results.append(monthly)
-
-        all_results.append(monthly)
-
-    final_df = pd.concat(all_results, ignore_index=True)
-    final_df.to_csv(args.out_file, index=False)
+            # --- Add total summary row ---
+            total_row = pd.DataFrame(
+                {
+                    "Title": [title],
+                    "Month": ["TOTAL"],
+                    "Days_in_month": [monthly["Days_in_month"].sum()],
+                    "Fixed_cost": [monthly["Fixed_cost"].sum().round(2)],
+                    "Variable_cost": [monthly["Variable_cost"].sum().round(2)],
+                    "Credits": [monthly["Credits"].sum().round(2)],
+                    "Discounts": [monthly["Discounts"].sum().round(2)],
+                    "Total_cost": [monthly["Total_cost"].sum().round(2)],
+                    "totalcostnotadjusted": [
+                        monthly["totalcostnotadjusted"].sum().round(2)
+                    ],
+                }
+            )
+            monthly = pd.concat([monthly, total_row], ignore_index=True)
+
+            # --- Print summary to console ---
+            totals = total_row.to_dict("records")[0]
+            total_days = totals["Days_in_month"]
+            fixed_cost = totals["Fixed_cost"]
+            variable_cost = totals["Variable_cost"]
+            credits = totals["Credits"]
+            discounts = totals["Discounts"]
+            total_cost = totals["Total_cost"]
+            total_cost_notadjusted = totals["totalcostnotadjusted"]
+
+            print(f"\n=== Summary for plan: {title} ===")
+            print(f"  Total days: {total_days}")
+            print(f"  Fixed cost: ${fixed_cost:.2f}")
+            print(f"  Variable cost: ${variable_cost:.2f}")
+            print(f"  Credits from exports: ${credits:.2f}")
+            print(f"  Discounts saved: ${discounts:.2f}")
+            print(f"  TOTAL cost: ${total_cost:.2f}")
+            print(
+                f"  Total before discounts and export credits: ${total_cost_notadjusted:.2f}"
+            )
+            print("=" * 40)
+
+            # --- Stream this plan's rows to the output CSV ---
+            monthly.to_csv(out, header=(i == 0), index=False)
+
     print(f"Saved results to {args.out_file}")
 
 